@@ -1,15 +1,19 @@
 # main.py - Clean and Optimized Sound Calculation API
 import numpy as np
 import trimesh
-from fastapi import FastAPI, HTTPException
+import shapely
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from typing import Literal
 import logging
 import os
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import multiprocessing as mp
-from functools import partial
+from functools import lru_cache, partial
 import threading
+import asyncio
 import time
 
 # ログの設定（デプロイ環境対応）
@@ -18,8 +22,7 @@ logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.StreamHandler(sys.stderr)
+        logging.StreamHandler(sys.stdout)
     ]
 )
 
@@ -43,16 +46,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 遮蔽判定に使うエンジン（Embreeの3Dレイキャスティング、使えない場合は建物断面の2D交差判定）
+RAY_ENGINE = "embree" if trimesh.ray.has_embree else "section"
+
 # グローバル変数（モデルのキャッシュ）
 building_mesh = None
 model_info = {
     "vertices": 0,
     "faces": 0,
     "bounds": None,
+    "ray_engine": RAY_ENGINE,
     "loaded": False
 }
 
 # 進捗管理
+# 計算はリクエストごとに別スレッドで並行して走り得るが、進捗はサーバー全体で1つのみ
+# （同時に複数の計算が走った場合は最後に更新したリクエストの進捗になる）
 progress_lock = threading.Lock()
 current_progress = {
     "total": 0,
@@ -70,6 +79,7 @@ class SoundRequest(BaseModel):
     calc_range: int = 2000   # 計算範囲（m）
     wind_direction: float = 0  # 風向き（度、0-359、北が0度）
     wind_speed: float = 0      # 風速（m/s）
+    response_format: Literal["json", "binary"] = "json"  # "binary" はfloat32の列指向バイナリ
 
 class SoundResult(BaseModel):
     x: float
@@ -78,169 +88,157 @@ class SoundResult(BaseModel):
     db: float
     distance: float
 
+# 距離減衰カーブの折れ点（100m: -20dB, 1km: -40dB, 5km: -60dB）
+DISTANCE_LOSS_KNOTS = (1, 100, 1000, 5000)
+DISTANCE_LOSS_DB = (0, 20, 40, 60)
+
+# 交差数ごとの遮蔽損失（軽減版: 15/25/35dB → 10/18/25dB、5交差以上は最大値）
+OBSTRUCTION_LOSS_DB = np.array([0, 10, 10, 18, 18, 25])
+
+# レイごとに追跡する交点数の上限（遮蔽損失は5交点で最大になるため、音源直近の交点分の余裕を加えた値）
+MAX_RAY_HITS = 8
+
+# 計算結果の列（process_chunkが返す配列の列順、バイナリ応答の列順）
+RESULT_COLUMNS = ("x", "y", "z", "db", "distance")
+
+def attach_ray_intersector(mesh):
+    """Embree（embreex）によるレイ交差判定エンジンをメッシュに設定"""
+    if RAY_ENGINE != "embree":
+        logging.error("❌ Embree is not available - obstruction falls back to 2D building sections (pip install embreex)")
+        return mesh
+    mesh.ray = trimesh.ray.ray_pyembree.RayMeshIntersector(mesh)
+    # BVHを事前に構築しておく（計算スレッドから同時に構築されないように）
+    mesh.ray.intersects_any(ray_origins=[[0, 0, 0]], ray_directions=[[1, 0, 0]])
+    return mesh
+
+def load_building_mesh(file_path):
+    """GLBファイルの建物メッシュを1つに結合して読み込む（頂点・面配列は .npz にキャッシュ）"""
+    cache_path = f"{file_path}.cache.npz"
+    source_mtime = os.path.getmtime(file_path)
+    
+    # GLBの更新時刻が一致するキャッシュがあればシーンの読み込み・クリーンアップを省略
+    if os.path.exists(cache_path):
+        try:
+            with np.load(cache_path) as cache:
+                if float(cache["source_mtime"]) == source_mtime:
+                    logging.info("⚡ Using cached mesh arrays: %s", cache_path)
+                    return trimesh.Trimesh(vertices=cache["vertices"], faces=cache["faces"], process=False)
+        except Exception as e:
+            logging.warning("Failed to read mesh cache %s: %s", cache_path, e)
+    
+    scene = trimesh.load(file_path)
+    
+    geometries = []
+    if hasattr(scene, 'geometry'):
+        geometries = [
+            geom for geom in scene.geometry.values()
+            if isinstance(geom, trimesh.Trimesh) and len(geom.vertices) > 0
+        ]
+    
+    if not geometries:
+        return None
+    
+    # 全ジオメトリ分の頂点・面バッファを一度に確保し、面の頂点番号をずらしながら詰める
+    # （キャッシュから読み込んだ場合と同じ配列になるよう float32/int32 に揃える）
+    vertices = np.empty((sum(len(geom.vertices) for geom in geometries), 3), dtype=np.float32)
+    faces = np.empty((sum(len(geom.faces) for geom in geometries), 3), dtype=np.int32)
+    vertex_offset = face_offset = 0
+    for geom in geometries:
+        vertices[vertex_offset:vertex_offset + len(geom.vertices)] = geom.vertices
+        face_slice = faces[face_offset:face_offset + len(geom.faces)]
+        face_slice[:] = geom.faces
+        face_slice += vertex_offset
+        vertex_offset += len(geom.vertices)
+        face_offset += len(geom.faces)
+    
+    # 縮退面・重複面の除去は結合後のメッシュに一度だけ行う
+    combined = trimesh.Trimesh(vertices=vertices, faces=faces, process=False)
+    combined.update_faces(combined.nondegenerate_faces())
+    combined.update_faces(combined.unique_faces())
+    vertices = combined.vertices.astype(np.float32)
+    faces = combined.faces.astype(np.int32)
+    try:
+        np.savez(cache_path, vertices=vertices, faces=faces, source_mtime=source_mtime)
+    except OSError as e:
+        logging.warning("Failed to write mesh cache %s: %s", cache_path, e)
+    
+    return trimesh.Trimesh(vertices=vertices, faces=faces, process=False)
+
+# 起動時に最初に試すモデルのパス（見つからない場合は MODEL_SEARCH_GLOBS でGLBを探す）
+MODEL_PATHS = (Path("models/bldg_Building.glb"), Path("bldg_Building.glb"))
+# 検索対象は models/ 以下と作業ディレクトリ直下のみ（.venv や node_modules などには入らない）
+MODEL_SEARCH_GLOBS = ((Path("models"), "**/*.glb"), (Path("."), "*.glb"))
+
 # サーバー起動時の処理
 @app.on_event("startup")
 def load_model():
     """GLBファイルを読み込み"""
-    global building_mesh, model_info
-    
-    potential_paths = [
-        "models/bldg_Building.glb",
-        "./models/bldg_Building.glb",
-        # "../frontend/public/models/sinjuku/bldg_Building.glb", 
-        # "./frontend/public/models/sinjuku/bldg_Building.glb",
-        # "bldg_Building.glb",
-        "./bldg_Building.glb"
-    ]
-    
-    for file_path in potential_paths:
-        try:
-            if not os.path.exists(file_path):
+    logging.info("🎯 Embree available: %s, obstruction engine: %s", trimesh.ray.has_embree, RAY_ENGINE)
+    
+    for file_path in MODEL_PATHS:
+        if file_path.exists() and load_model_file(file_path):
+            return
+    
+    # 既定のパスにない場合はGLBを検索して順に読み込みを試す
+    logging.warning("⚠️ No model at %s, searching %s for GLB files", [str(p) for p in MODEL_PATHS], Path.cwd())
+    tried_paths = {file_path.resolve() for file_path in MODEL_PATHS}
+    for directory, pattern in MODEL_SEARCH_GLOBS:
+        for file_path in directory.glob(pattern):
+            if file_path.resolve() in tried_paths:
                 continue
-                
-            logging.info(f"Loading model from: {file_path}")
-            scene = trimesh.load(file_path)
-            
-            meshes = []
-            if hasattr(scene, 'geometry'):
-                for name, geom in scene.geometry.items():
-                    if isinstance(geom, trimesh.Trimesh) and len(geom.vertices) > 0:
-                        geom.remove_degenerate_faces()
-                        geom.remove_duplicate_faces()
-                        meshes.append(geom)
-            
-            if meshes:
-                building_mesh = trimesh.util.concatenate(meshes)
-                model_info.update({
-                    "vertices": len(building_mesh.vertices),
-                    "faces": len(building_mesh.faces),
-                    "bounds": building_mesh.bounds.tolist(),
-                    "loaded": True
-                })
-                logging.info(f"✅ Model loaded successfully: {model_info['vertices']} vertices, {model_info['faces']} faces from {file_path}")
-                break
-                
-        except Exception as e:
-            logging.error(f"Failed to load {file_path}: {e}")
-            continue
+            tried_paths.add(file_path.resolve())
+            if load_model_file(file_path):
+                return
     
-    if building_mesh is None:
-        logging.error("❌ CRITICAL: No valid model could be loaded from any path!")
-        logging.error("Searching in all possible directories...")
-        try:
-            current_dir = os.getcwd()
-            logging.info(f"📂 Current directory: {current_dir}")
-            
-            # すべての可能なディレクトリを再帰的に検索してGLBを自動読み込み
-            found_glb_paths = []
-            
-            def find_and_try_load_glb(directory, max_depth=3, current_depth=0):
-                if current_depth > max_depth:
-                    return
-                try:
-                    files = os.listdir(directory)
-                    logging.info(f"📁 Checking directory: {directory}")
-                    logging.info(f"   Files: {files}")
-                    
-                    for file in files:
-                        file_path = os.path.join(directory, file)
-                        if file.endswith(".glb"):
-                            logging.info(f"✅ Found GLB: {file_path}")
-                            found_glb_paths.append(file_path)
-                            
-                            # 見つけたGLBファイルで読み込み試行
-                            if try_load_glb_file(file_path):
-                                return True
-                                
-                        elif os.path.isdir(file_path) and not file.startswith('.'):
-                            if find_and_try_load_glb(file_path, max_depth, current_depth + 1):
-                                return True
-                except Exception as e:
-                    logging.warning(f"Cannot access {directory}: {e}")
-                return False
-            
-            # GLBファイルを探して自動読み込み
-            if find_and_try_load_glb("."):
-                logging.info("🎉 Building model loaded successfully from auto-discovery!")
-            elif find_and_try_load_glb(".."):
-                logging.info("🎉 Building model loaded successfully from parent directory!")
-            else:
-                logging.error(f"❌ No loadable GLB found. Discovered paths: {found_glb_paths}")
-                
-        except Exception as e:
-            logging.error(f"Error during comprehensive search: {e}")
-        
-        if building_mesh is None:
-            model_info["loaded"] = False
+    model_info["loaded"] = False
+    logging.error("❌ CRITICAL: No valid model could be loaded from any path!")
 
-def try_load_glb_file(file_path):
-    """GLBファイルの読み込みを試行する共通関数"""
-    global building_mesh, model_info
+def load_model_file(file_path):
+    """GLBファイルを建物モデルとして読み込み、成功したら True を返す"""
+    global building_mesh
     try:
-        logging.info(f"🔄 Attempting to load: {file_path}")
-        scene = trimesh.load(file_path)
-        
-        meshes = []
-        if hasattr(scene, 'geometry'):
-            for name, geom in scene.geometry.items():
-                if isinstance(geom, trimesh.Trimesh) and len(geom.vertices) > 0:
-                    geom.remove_degenerate_faces()
-                    geom.remove_duplicate_faces()
-                    meshes.append(geom)
-        
-        if meshes:
-            building_mesh = trimesh.util.concatenate(meshes)
-            
-            # モデルの健全性チェック
-            is_watertight = building_mesh.is_watertight
-            volume = building_mesh.volume if is_watertight else "N/A"
-            bounds = building_mesh.bounds
-            center = bounds.mean(axis=0)
-            size = bounds[1] - bounds[0]
-            
-            model_info.update({
-                "vertices": len(building_mesh.vertices),
-                "faces": len(building_mesh.faces),
-                "bounds": bounds.tolist(),
-                "center": center.tolist(),
-                "size": size.tolist(),
-                "is_watertight": is_watertight,
-                "volume": float(volume) if volume != "N/A" else None,
-                "loaded": True
-            })
-            
-            print(f"✅ Model loaded: {model_info['vertices']} vertices, {model_info['faces']} faces from {file_path}")
-            print(f"🏗️ Model health check:")
-            print(f"   📐 Bounds: min=({bounds[0][0]:.1f},{bounds[0][1]:.1f},{bounds[0][2]:.1f}) max=({bounds[1][0]:.1f},{bounds[1][1]:.1f},{bounds[1][2]:.1f})")
-            print(f"   📍 Center: ({center[0]:.1f},{center[1]:.1f},{center[2]:.1f})")
-            print(f"   📏 Size: ({size[0]:.1f}×{size[1]:.1f}×{size[2]:.1f})")
-            print(f"   🔧 Watertight: {is_watertight}, Volume: {volume}")
-            
-            # レイキャスティング機能のテスト
-            try:
-                test_ray = building_mesh.ray.intersects_location(
-                    ray_origins=[[0, 0, 0]],
-                    ray_directions=[[1, 0, 0]]
-                )
-                print(f"   🎯 Ray casting test: SUCCESS")
-            except Exception as e:
-                print(f"   ❌ Ray casting test: FAILED - {e}")
-                
-            logging.info(f"✅ Model loaded: {model_info['vertices']} vertices, {model_info['faces']} faces from {file_path}")
-            logging.info(f"🏗️ Model health check:")
-            logging.info(f"   📐 Bounds: min=({bounds[0][0]:.1f},{bounds[0][1]:.1f},{bounds[0][2]:.1f}) max=({bounds[1][0]:.1f},{bounds[1][1]:.1f},{bounds[1][2]:.1f})")
-            logging.info(f"   📍 Center: ({center[0]:.1f},{center[1]:.1f},{center[2]:.1f})")
-            logging.info(f"   📏 Size: ({size[0]:.1f}×{size[1]:.1f}×{size[2]:.1f})")
-            logging.info(f"   🔧 Watertight: {is_watertight}, Volume: {volume}")
-            
-            # 座標系の妥当性チェック
-            if abs(center[0]) > 10000 or abs(center[1]) > 1000 or abs(center[2]) > 10000:
-                logging.warning(f"⚠️ Model coordinates seem unusual - check coordinate system")
-            
-            return True
+        logging.info("🔄 Loading model from: %s", file_path)
+        mesh = load_building_mesh(file_path)
     except Exception as e:
-        logging.warning(f"Failed to load {file_path}: {e}")
-    return False
+        logging.warning("Failed to load %s: %s", file_path, e)
+        return False
+    
+    if mesh is None:
+        logging.warning("No triangle meshes in %s", file_path)
+        return False
+    
+    building_mesh = attach_ray_intersector(mesh)
+    
+    # モデルの健全性チェック
+    is_watertight = building_mesh.is_watertight
+    volume = float(building_mesh.volume) if is_watertight else None
+    bounds = building_mesh.bounds
+    center = bounds.mean(axis=0)
+    size = bounds[1] - bounds[0]
+    
+    model_info.update({
+        "vertices": len(building_mesh.vertices),
+        "faces": len(building_mesh.faces),
+        "bounds": bounds.tolist(),
+        "center": center.tolist(),
+        "size": size.tolist(),
+        "is_watertight": is_watertight,
+        "volume": volume,
+        "loaded": True
+    })
+    
+    logging.info("✅ Model loaded: %d vertices, %d faces from %s", model_info["vertices"], model_info["faces"], file_path)
+    logging.info("🏗️ Model health check:")
+    logging.info("   📐 Bounds: min=(%.1f,%.1f,%.1f) max=(%.1f,%.1f,%.1f)", *bounds[0], *bounds[1])
+    logging.info("   📍 Center: (%.1f,%.1f,%.1f)", *center)
+    logging.info("   📏 Size: (%.1f×%.1f×%.1f)", *size)
+    logging.info("   🔧 Watertight: %s, Volume: %s", is_watertight, volume)
+    
+    # 座標系の妥当性チェック
+    if abs(center[0]) > 10000 or abs(center[1]) > 1000 or abs(center[2]) > 10000:
+        logging.warning("⚠️ Model coordinates seem unusual - check coordinate system")
+    
+    return True
 
 # APIエンドポイント
 @app.get("/model_info")
@@ -273,7 +271,16 @@ async def get_calculation_progress():
 
 @app.post("/calculate_sound/")
 async def calculate_sound(request: SoundRequest):
-    """音響シミュレーションを実行"""
+    """音響シミュレーションを実行（重い計算は別スレッドで行い、イベントループを塞がない）"""
+    return await asyncio.to_thread(run_sound_calculation, request)
+
+def update_progress(**values):
+    """進捗状況を更新"""
+    with progress_lock:
+        current_progress.update(values)
+
+def run_sound_calculation(request):
+    """音響シミュレーションの本体（同期処理）"""
     if building_mesh is None or not model_info["loaded"]:
         logging.error("❌ Building model not loaded! Using fallback calculation without obstruction.")
         # フォールバック：建物なしで計算を継続
@@ -281,7 +288,7 @@ async def calculate_sound(request: SoundRequest):
     else:
         building_mesh_fallback = building_mesh
 
-    source_pos = np.array(request.source_pos, dtype=np.float64)
+    source_pos = np.array(request.source_pos, dtype=np.float32)
     initial_db = request.initial_db
     grid_size = request.grid_size
     calc_range = request.calc_range
@@ -289,14 +296,10 @@ async def calculate_sound(request: SoundRequest):
     wind_speed = request.wind_speed
     
     # 座標系と計算範囲の詳細ログ
-    print(f"🎵 Sound calculation started:")
-    print(f"   🎯 Source position: ({source_pos[0]:.1f},{source_pos[1]:.1f},{source_pos[2]:.1f})")
-    print(f"   🔊 Initial dB: {initial_db}, Grid: {grid_size}m, Range: {calc_range}m")
-    print(f"   🌬️ Wind: {wind_direction:.0f}° at {wind_speed:.1f}m/s")
-    logging.info(f"🎵 Sound calculation started:")
-    logging.info(f"   🎯 Source position: ({source_pos[0]:.1f},{source_pos[1]:.1f},{source_pos[2]:.1f})")
-    logging.info(f"   🔊 Initial dB: {initial_db}, Grid: {grid_size}m, Range: {calc_range}m")
-    logging.info(f"   🌬️ Wind: {wind_direction:.0f}° at {wind_speed:.1f}m/s")
+    logging.info("🎵 Sound calculation started:")
+    logging.info("   🎯 Source position: (%.1f,%.1f,%.1f)", *source_pos)
+    logging.info("   🔊 Initial dB: %s, Grid: %sm, Range: %sm", initial_db, grid_size, calc_range)
+    logging.info("   🌬️ Wind: %.0f° at %.1fm/s", wind_direction, wind_speed)
     
     # 建物との位置関係チェック
     if building_mesh_fallback is not None:
@@ -305,158 +308,167 @@ async def calculate_sound(request: SoundRequest):
         distance_to_center = np.linalg.norm(source_pos - model_center)
         
         # 音源が建物範囲内にあるかチェック
-        in_bounds = all(model_bounds[0] <= source_pos) and all(source_pos <= model_bounds[1])
-        
-        print(f"   🏢 Model center: ({model_center[0]:.1f},{model_center[1]:.1f},{model_center[2]:.1f})")
-        print(f"   📏 Distance to model center: {distance_to_center:.1f}m")
-        print(f"   🎯 Source in bounds: {in_bounds}")
+        in_bounds = bool(((source_pos >= model_bounds[0]) & (source_pos <= model_bounds[1])).all())
         
         # 計算グリッドと建物の重複チェック
         calc_bounds = [
             source_pos - calc_range,
             source_pos + calc_range
         ]
-        grid_overlaps_model = not (
-            np.all(calc_bounds[1] < model_bounds[0]) or 
-            np.all(calc_bounds[0] > model_bounds[1])
-        )
-        
-        print(f"   🗂️ Calc grid bounds: min=({calc_bounds[0][0]:.1f},{calc_bounds[0][1]:.1f},{calc_bounds[0][2]:.1f}) max=({calc_bounds[1][0]:.1f},{calc_bounds[1][1]:.1f},{calc_bounds[1][2]:.1f})")
-        print(f"   🔗 Grid overlaps model: {grid_overlaps_model}")
+        grid_overlaps_model = bool(((calc_bounds[1] >= model_bounds[0]) & (calc_bounds[0] <= model_bounds[1])).all())
         
-        if not grid_overlaps_model:
-            print("⚠️ WARNING: Calculation grid does not overlap with building model!")
-            
-        logging.info(f"   🏢 Model center: ({model_center[0]:.1f},{model_center[1]:.1f},{model_center[2]:.1f})")
-        logging.info(f"   📏 Distance to model center: {distance_to_center:.1f}m")
-        logging.info(f"   🎯 Source in bounds: {in_bounds}")
-        logging.info(f"   🗂️ Calc grid bounds: min=({calc_bounds[0][0]:.1f},{calc_bounds[0][1]:.1f},{calc_bounds[0][2]:.1f}) max=({calc_bounds[1][0]:.1f},{calc_bounds[1][1]:.1f},{calc_bounds[1][2]:.1f})")
-        logging.info(f"   🔗 Grid overlaps model: {grid_overlaps_model}")
+        logging.info("   🏢 Model center: (%.1f,%.1f,%.1f)", *model_center)
+        logging.info("   📏 Distance to model center: %.1fm", distance_to_center)
+        logging.info("   🎯 Source in bounds: %s", in_bounds)
+        logging.info("   🗂️ Calc grid bounds: min=(%.1f,%.1f,%.1f) max=(%.1f,%.1f,%.1f)", *calc_bounds[0], *calc_bounds[1])
+        logging.info("   🔗 Grid overlaps model: %s", grid_overlaps_model)
         
         if not grid_overlaps_model:
             logging.warning("⚠️ Calculation grid does not overlap with building model - no obstruction will be detected!")
     
-    # 計算点を生成
-    steps = int(calc_range / grid_size)
-    calculation_points = []
-    
-    for x_step in range(-steps, steps + 1):
-        for z_step in range(-steps, steps + 1):
-            x = source_pos[0] + x_step * grid_size
-            z = source_pos[2] + z_step * grid_size
-            y = source_pos[1]
-            
-            # 円形範囲チェック
-            xz_distance = np.sqrt((x - source_pos[0])**2 + (z - source_pos[2])**2)
-            if xz_distance <= calc_range:
-                target_pos = np.array([x, y, z])
-                distance = np.linalg.norm(target_pos - source_pos)
-                if distance >= 1:
-                    calculation_points.append((x, y, z, distance))
-    
+    # 計算点を生成（相対グリッドはキャッシュ済み、音源位置で平行移動するだけ）
+    grid_offsets, grid_distances = calculation_grid_template(grid_size, calc_range)
+    calculation_points = np.column_stack([grid_offsets + source_pos, grid_distances])
+
     total_points = len(calculation_points)
-    logging.info(f"Total calculation points: {total_points}")
-    
-    # 並列処理で計算実行
-    chunk_size = max(1, total_points // (mp.cpu_count() * 2))
-    chunks = [calculation_points[i:i + chunk_size] 
-              for i in range(0, total_points, chunk_size)]
-    
-    results = []
-    with ProcessPoolExecutor(max_workers=mp.cpu_count()) as executor:
-        # 各チャンクを並列処理
-        future_to_chunk = {
-            executor.submit(
-                process_chunk, 
-                chunk, 
-                source_pos.tolist(), 
-                initial_db, 
-                building_mesh_fallback.vertices.tolist() if building_mesh_fallback is not None else [],
-                building_mesh_fallback.faces.tolist() if building_mesh_fallback is not None else [],
-                wind_direction,
-                wind_speed
-            ): chunk for chunk in chunks
-        }
+    logging.info("Total calculation points: %d", total_points)
+    update_progress(total=total_points, completed=0, percentage=0.0, status="calculating", start_time=time.time())
+    
+    try:
+        # Embreeが使えない場合は、音源の高さでの建物断面（2D）で遮蔽を判定する
+        building_section = None
+        if building_mesh_fallback is not None and RAY_ENGINE == "section":
+            building_section = calculate_building_section(building_mesh_fallback, source_pos[1])
+    
+        # 並列処理で計算実行
+        chunks = np.array_split(calculation_points, max(1, min(total_points, mp.cpu_count() * 2)))
+    
+        results = []
+        # Embreeのレイキャスティングは GIL を解放するため、スレッドで共有メッシュ（BVH）をそのまま使う
+        with ThreadPoolExecutor(max_workers=mp.cpu_count()) as executor:
+            # 各チャンクを並列処理
+            future_to_chunk = {
+                executor.submit(
+                    process_chunk, 
+                    chunk, 
+                    source_pos, 
+                    initial_db, 
+                    building_mesh_fallback,
+                    building_section,
+                    wind_direction,
+                    wind_speed
+                ): chunk for chunk in chunks
+            }
         
-        completed = 0
-        for future in as_completed(future_to_chunk):
-            try:
-                chunk_results = future.result()
-                results.extend(chunk_results)
-                completed += len(chunk_results)
+            completed = 0
+            for future in as_completed(future_to_chunk):
+                try:
+                    chunk_results = future.result()
+                    results.append(chunk_results)
+                    completed += len(chunk_results)
                 
-                progress = (completed / total_points) * 100
-                if completed % 500 == 0 or completed == total_points:
-                    logging.info(f"Progress: {completed}/{total_points} points ({progress:.1f}%) completed")
+                    progress = (completed / total_points) * 100 if total_points else 100.0
+                    update_progress(completed=completed, percentage=progress)
+                    if completed % 500 == 0 or completed == total_points:
+                        logging.info("Progress: %d/%d points (%.1f%%) completed", completed, total_points, progress)
                     
-            except Exception as e:
-                logging.error(f"Chunk calculation failed: {e}")
+                except Exception as e:
+                    logging.error("Chunk calculation failed: %s", e)
+    
+        results = np.concatenate(results) if results else np.empty((0, len(RESULT_COLUMNS)), dtype=np.float32)
+    except Exception:
+        # 失敗時も "calculating" のまま残らないようにする
+        update_progress(status="error")
+        raise
     
-    logging.info(f"Sound calculation completed: {len(results)} points processed")
+    logging.info("Sound calculation completed: %d points processed", len(results))
+    update_progress(status="completed")
     
+    if request.response_format == "binary":
+        return Response(content=pack_binary_results(results), media_type="application/octet-stream")
+    
+    # float32 の丸め誤差（1.100000023841858 など）がJSONに出ないよう、float64 にして小数3桁に丸める
+    json_results = np.round(results.astype(np.float64), 3)
     return {
-        "results": results,
-        "source_pos": source_pos.tolist(),
+        "results": [dict(zip(RESULT_COLUMNS, row)) for row in json_results.tolist()],
+        "source_pos": request.source_pos,
         "initial_db": initial_db,
         "grid_size": grid_size,
         "calc_range": calc_range,
         "points_processed": len(results)
     }
 
-def process_chunk(points, source_pos, initial_db, mesh_vertices, mesh_faces, wind_direction, wind_speed):
-    """チャンクの計算処理（風の影響を含む）"""
-    # メッシュを再構築（建物モデルがある場合のみ）
-    mesh = None
-    if mesh_vertices and mesh_faces:
-        vertices = np.array(mesh_vertices)
-        faces = np.array(mesh_faces)
-        mesh = trimesh.Trimesh(vertices=vertices, faces=faces)
-    
-    source_pos = np.array(source_pos)
-    results = []
+@lru_cache(maxsize=16)
+def calculation_grid_template(grid_size, calc_range):
+    """音源を原点とした計算点の相対位置と距離（grid_size・calc_rangeごとにキャッシュ）
     
-    for x, y, z, distance in points:
-        target_pos = np.array([x, y, z])
-        
-        # 建物モデルの有無で計算方法を分岐
-        if mesh is not None:
-            # 建物遮蔽ありの計算（風の影響を含む）
-            final_db = calculate_fast_sound_attenuation_with_wind(source_pos, target_pos, initial_db, mesh, wind_direction, wind_speed)
-        else:
-            # 建物遮蔽なしの計算（距離減衰のみ、風の影響を含む）
-            final_db = calculate_distance_only_attenuation_with_wind(source_pos, target_pos, initial_db, wind_direction, wind_speed)
-        
-        results.append({
-            "x": x,
-            "y": y,
-            "z": z,
-            "db": final_db,
-            "distance": distance
-        })
-    
-    return results
-
-def calculate_wind_effect(source_pos, target_pos, wind_direction, wind_speed):
-    """風の影響による音の減衰・増幅を計算"""
-    if wind_speed < 0.1:  # 風速が非常に弱い場合は無視
-        return 0
+    計算点は音源と同じ高さなので y は 0、距離は xz 平面上の距離と等しい
+    """
+    steps = int(calc_range / grid_size)
+    step_offsets = (np.arange(-steps, steps + 1) * grid_size).astype(np.float32)
+    x_grid, z_grid = np.meshgrid(step_offsets, step_offsets, indexing='ij')
+    offsets = np.stack([
+        x_grid.ravel(),
+        np.zeros(x_grid.size, dtype=np.float32),
+        z_grid.ravel()
+    ], axis=1)
+    distances = np.linalg.norm(offsets, axis=1)
+    
+    # 円形範囲チェック
+    in_range = (distances <= calc_range) & (distances >= 1)
+    offsets, distances = offsets[in_range], distances[in_range]
+    offsets.flags.writeable = False
+    distances.flags.writeable = False
+    return offsets, distances
+
+def pack_binary_results(results):
+    """計算結果を列指向のfloat32バイナリに変換（先頭にint32で点数・列数のヘッダ）"""
+    header = np.array([len(results), len(RESULT_COLUMNS)], dtype='<i4')
+    columns = np.ascontiguousarray(results.T, dtype='<f4')
+    return header.tobytes() + columns.tobytes()
+
+def process_chunk(points, source_pos, initial_db, mesh, section, wind_direction, wind_speed):
+    """チャンクの計算処理（風の影響を含む、建物モデルがない場合 mesh は None）
+    
+    戻り値は RESULT_COLUMNS の列順の (N, 5) 配列
+    """
+    target_positions = points[:, :3]
+    distances = points[:, 3]
+    
+    # 距離減衰・空気吸収のみの音圧レベル（チャンク全体でまとめて計算）
+    free_field_dbs = calculate_sound_attenuation(distances, initial_db)
+    
+    # 建物遮蔽はチャンク内の全レイをまとめて一度に計算（建物モデルがない場合は遮蔽なし）
+    # 遮蔽がなくても0dBの計算点は遮蔽の有無で結果が変わらないため、レイキャスティングを省略
+    obstruction_losses = np.zeros(len(points))
+    if mesh is not None:
+        audible = free_field_dbs > 0
+        obstruction_losses[audible] = calculate_obstruction_losses(
+            source_pos, target_positions[audible], distances[audible], mesh, section
+        )
+    base_dbs = np.maximum(free_field_dbs - obstruction_losses, 0)
     
-    # 音の進行方向ベクトル
-    sound_vector = target_pos - source_pos
-    sound_distance = np.linalg.norm(sound_vector)
+    # 風の効果
+    wind_effects = calculate_wind_effect(source_pos, target_positions, distances, wind_direction, wind_speed)
+    final_dbs = np.maximum(base_dbs + wind_effects, 0)
     
-    if sound_distance < 1:
+    return np.column_stack([target_positions, final_dbs.astype(np.float32), distances])
+
+def calculate_wind_effect(source_pos, target_positions, sound_distances, wind_direction, wind_speed):
+    """風の影響による音の減衰・増幅を計算（全計算点をまとめて計算、sound_distances は計算済みの距離）"""
+    if wind_speed < 0.1:  # 風速が非常に弱い場合は無視
         return 0
     
-    sound_direction_norm = sound_vector / sound_distance
+    # 音の進行方向ベクトル（XZ平面のみ）
+    sound_vectors_xz = target_positions[:, [0, 2]] - source_pos[[0, 2]]
     
     # 風向きを度からラジアンに変換（北が0度、東が90度）
     wind_rad = np.radians(wind_direction)
-    # 風のベクトル（風の吹く方向）
-    wind_vector = np.array([np.sin(wind_rad), 0, np.cos(wind_rad)])  # Y軸は上下、風は水平
+    # 風のベクトル（風の吹く方向、Y軸は上下で風は水平なのでXZ成分のみ）
+    wind_vector_xz = np.array([np.sin(wind_rad), np.cos(wind_rad)])
     
     # 音の進行方向と風向きの内積（風下ほど正の値）
-    wind_alignment = np.dot(sound_direction_norm[[0, 2]], wind_vector[[0, 2]])  # XZ平面のみで計算
+    wind_alignment = (sound_vectors_xz @ wind_vector_xz) / sound_distances
     
     # 風の効果による減衰・増幅
     # 風下（wind_alignment > 0）: 音が地面に曲がり、減衰が少なくなる（負の値で増幅）
@@ -464,143 +476,154 @@ def calculate_wind_effect(source_pos, target_pos, wind_direction, wind_speed):
     
     # 風速と距離に比例した効果（最大±10dB程度）
     max_effect = min(wind_speed * 2, 10)  # 風速1m/sで最大2dB、上限10dB
-    distance_factor = min(sound_distance / 1000, 1)  # 1km以上で最大効果
+    distance_factor = np.minimum(sound_distances / 1000, 1)  # 1km以上で最大効果
     
     wind_effect = -wind_alignment * max_effect * distance_factor
     
-    return wind_effect
+    return np.where(sound_distances < 1, 0, wind_effect)
 
-def calculate_distance_only_attenuation_with_wind(source_pos, target_pos, initial_db, wind_direction, wind_speed):
-    """建物モデルなしの場合の距離減衰計算（風の影響を含む）"""
-    # 基本の距離減衰
-    base_attenuation = calculate_distance_only_attenuation(source_pos, target_pos, initial_db)
-    
-    # 風の効果
-    wind_effect = calculate_wind_effect(source_pos, target_pos, wind_direction, wind_speed)
+def calculate_sound_attenuation(distances, initial_db):
+    """距離減衰・空気吸収による音圧レベル（現実的なモデル、全計算点をまとめて計算）
     
-    return max(base_attenuation + wind_effect, 0)
-
-def calculate_fast_sound_attenuation_with_wind(source_pos, target_pos, initial_db, mesh, wind_direction, wind_speed):
-    """建物遮蔽ありの音響計算（風の影響を含む）"""
-    # 基本の音響計算
-    base_attenuation = calculate_fast_sound_attenuation(source_pos, target_pos, initial_db, mesh)
+    中間配列を作らないよう、減衰量は一つのバッファに in-place で積み上げる
+    """
+    # より現実的な距離減衰モデル（1m-5kmは折れ線なので np.interp の一回の走査で計算）
+    attenuation = np.interp(distances, DISTANCE_LOSS_KNOTS, DISTANCE_LOSS_DB)
     
-    # 風の効果
-    wind_effect = calculate_wind_effect(source_pos, target_pos, wind_direction, wind_speed)
-    
-    return max(base_attenuation + wind_effect, 0)
-
-def calculate_distance_only_attenuation(source_pos, target_pos, initial_db):
-    """建物モデルなしの場合の距離減衰のみの計算（現実的なモデル）"""
-    distance = np.linalg.norm(target_pos - source_pos)
-    if distance < 1.0:
-        return initial_db
-    
-    # より現実的な距離減衰モデル
-    # 100m: -20dB, 1km: -40dB, 5km: -60dBのカーブに調整
-    if distance <= 100:
-        # 1m-100m: 線形減衰で約20dB
-        distance_loss = 20 * (distance - 1) / 99
-    elif distance <= 1000:
-        # 100m-1km: 20dB追加で合計40dB
-        distance_loss = 20 + 20 * (distance - 100) / 900
-    elif distance <= 5000:
-        # 1km-5km: 20dB追加で合計60dB
-        distance_loss = 40 + 20 * (distance - 1000) / 4000
-    else:
-        # 5km以上: 最大60dB減衰 + 追加で緩やかに減衰
-        distance_loss = 60 + 10 * np.log10(distance / 5000)
+    # 5km以上: 最大60dB減衰 + 追加で緩やかに減衰
+    far = distances > DISTANCE_LOSS_KNOTS[-1]
+    if far.any():
+        attenuation[far] += 10 * np.log10(distances[far] / DISTANCE_LOSS_KNOTS[-1])
     
     # 軽度の空気吸収（長距離のみ影響）
-    air_absorption = max(0, (distance - 100) * 0.0005)
-    
-    final_db = initial_db - distance_loss - air_absorption
-    return max(final_db, 0)
-
-def calculate_fast_sound_attenuation(source_pos, target_pos, initial_db, mesh):
-    """高速な音の減衰計算（現実的なモデル）"""
-    distance = np.linalg.norm(target_pos - source_pos)
-    if distance < 1.0:
-        return initial_db
-    
-    # 現実的な距離減衰（建物なしと同じ基本減衰）
-    if distance <= 100:
-        distance_loss = 20 * (distance - 1) / 99
-    elif distance <= 1000:
-        distance_loss = 20 + 20 * (distance - 100) / 900
-    elif distance <= 5000:
-        distance_loss = 40 + 20 * (distance - 1000) / 4000
-    else:
-        distance_loss = 60 + 10 * np.log10(distance / 5000)
-    
-    # 建物による遮蔽（高速版）
-    obstruction_loss = calculate_fast_obstruction(source_pos, target_pos, mesh)
+    attenuation += np.maximum(distances - 100, 0) * 0.0005
     
-    # デバッグ用ログ（一部の計算でのみ出力）
-    if np.random.random() < 0.01:  # 1%の確率でログ出力
-        logging.info(f"🔍 Sound calc: src=({source_pos[0]:.1f},{source_pos[1]:.1f},{source_pos[2]:.1f}) -> tgt=({target_pos[0]:.1f},{target_pos[1]:.1f},{target_pos[2]:.1f})")
-        logging.info(f"🔍 distance={distance:.1f}m, distance_loss={distance_loss:.1f}dB, obstruction_loss={obstruction_loss:.1f}dB")
+    final_db = np.subtract(initial_db, attenuation, out=attenuation)
+    np.maximum(final_db, 0, out=final_db)
+    final_db[distances < 1.0] = initial_db
+    return final_db
+
+def segments_intersect_bounds(source_pos, directions, bounds, padding=0.1):
+    """音源から各受音点への線分がバウンディングボックスと交差するか判定（スラブ法）"""
+    bounds_min = bounds[0] - padding
+    bounds_max = bounds[1] + padding
+    # 軸に平行な成分でゼロ除算にならないよう微小値に置き換える
+    safe_directions = np.where(np.abs(directions) < 1e-12, 1e-12, directions)
+    t1 = (bounds_min - source_pos) / safe_directions
+    t2 = (bounds_max - source_pos) / safe_directions
+    t_enter = np.maximum(np.minimum(t1, t2).max(axis=1), 0.0)
+    t_exit = np.minimum(np.maximum(t1, t2).min(axis=1), 1.0)
+    return t_enter <= t_exit
+
+def calculate_building_section(mesh, height):
+    """建物メッシュを音源の高さで水平に切断した断面（XZ平面の線分とその空間インデックス）"""
+    segments = trimesh.intersections.mesh_plane(
+        mesh,
+        plane_normal=[0, 1, 0],
+        plane_origin=[0, height, 0]
+    )[:, :, [0, 2]]
+    return segments, shapely.STRtree(shapely.linestrings(segments))
+
+def calculate_obstruction_losses(source_pos, target_positions, distances, mesh, section=None):
+    """建物による遮蔽損失をまとめて計算（全レイを一度に処理、distances は計算済みの距離）
+    
+    section が与えられた場合は3Dのレイキャスティングの代わりに建物断面との2D交差判定を使う
+    """
+    directions = target_positions - source_pos
+    ray_count = len(target_positions)
+    intersection_counts = np.zeros(ray_count, dtype=np.int64)
+    
+    # バウンディングボックスと交差しない線分は遮蔽なし（レイキャスティング不要）
+    candidates = np.flatnonzero(segments_intersect_bounds(source_pos, directions, mesh.bounds))
+    if len(candidates) == 0:
+        return np.zeros(ray_count, dtype=OBSTRUCTION_LOSS_DB.dtype)
+    
+    if section is not None:
+        intersection_counts[candidates] = count_section_crossings(
+            source_pos, target_positions[candidates], distances[candidates], section
+        )
+    else:
+        intersection_counts[candidates] = count_ray_intersections(
+            source_pos, directions[candidates], distances[candidates], mesh
+        )
     
-    # 軽度の空気吸収（長距離のみ影響）
-    air_absorption = max(0, (distance - 100) * 0.0005)
+    # デバッグ用ログ（DEBUGレベルが有効な場合のみ集計する）
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(
+            "🏢 Obstruction: rays=%d, in_bounds=%d, obstructed=%d, max_intersections=%d",
+            ray_count, len(candidates), np.count_nonzero(intersection_counts), intersection_counts.max()
+        )
     
-    final_db = initial_db - distance_loss - obstruction_loss - air_absorption
-    return max(final_db, 0)
+    # 遮蔽による損失（交差数でテーブルを引く）
+    return OBSTRUCTION_LOSS_DB[np.minimum(intersection_counts, len(OBSTRUCTION_LOSS_DB) - 1)]
 
-def calculate_fast_obstruction(source_pos, target_pos, mesh):
-    """高速な遮蔽計算（デバッグ強化版）"""
-    try:
-        direction = target_pos - source_pos
-        distance = np.linalg.norm(direction)
-        
-        if distance < 1e-6:
-            return 0
-        
-        ray_direction = direction / distance
-        
-        # レイキャスティング
+def count_ray_intersections(source_pos, directions, distances, mesh):
+    """音源から各受音点へのレイと建物メッシュの交差数（3Dレイキャスティング、全レイを一括）
+
+    最初の交点を求めてレイを交点の先へ進めることを繰り返し、受音点を越えたレイ
+    （tfar = 距離 - 0.1）と遮蔽損失が最大になったレイはそこで追跡を打ち切る
+    """
+    ray_directions = directions / distances[:, None]
+    ray_origins = np.tile(source_pos, (len(directions), 1)).astype(np.float64)
+    # 交点の面の反対側へ移すためのオフセット（trimesh の multiple_hits と同じ値）
+    ray_offsets = ray_directions * max(1e-4 * mesh.scale, 1e-8)
+    max_count = len(OBSTRUCTION_LOSS_DB) - 1
+    intersection_counts = np.zeros(len(directions), dtype=np.int64)
+    active = np.arange(len(directions))
+
+    for _ in range(MAX_RAY_HITS):
         try:
-            locations, _, _ = mesh.ray.intersects_location(
-                ray_origins=[source_pos],
-                ray_directions=[ray_direction]
+            _, index_ray, locations = mesh.ray.intersects_id(
+                ray_origins=ray_origins[active],
+                ray_directions=ray_directions[active],
+                multiple_hits=False,
+                return_locations=True
             )
-        except Exception as ray_error:
-            if np.random.random() < 0.01:
-                print(f"❌ Ray casting failed: {ray_error}")
-            return 0
-        
-        # 有効な交点をカウント
-        valid_intersections = 0
-        intersection_distances = []
-        for loc in locations:
-            intersection_distance = np.linalg.norm(loc - source_pos)
-            if 0.1 < intersection_distance < distance - 0.1:
-                valid_intersections += 1
-                intersection_distances.append(intersection_distance)
-        
-        # デバッグ用ログ（一部の計算でのみ出力）
-        if np.random.random() < 0.05:  # 5%の確率でログ出力
-            print(f"🏢 Ray debug: total_hits={len(locations)}, valid_intersections={valid_intersections}")
-            print(f"🏢 All intersection distances: {[np.linalg.norm(loc - source_pos) for loc in locations]}")
-            print(f"🏢 Target distance: {distance:.1f}m")
-            logging.info(f"🏢 Ray: src=({source_pos[0]:.1f},{source_pos[1]:.1f},{source_pos[2]:.1f}) dir=({ray_direction[0]:.2f},{ray_direction[1]:.2f},{ray_direction[2]:.2f})")
-            logging.info(f"🏢 Intersections: {valid_intersections}, distances={intersection_distances[:3]}, total_hits={len(locations)}")
-        
-        # 遮蔽による損失（軽減版）
-        if valid_intersections == 0:
-            return 0
-        elif valid_intersections <= 2:
-            return 10  # 軽度の遮蔽（15dB→10dB）
-        elif valid_intersections <= 4:
-            return 18  # 中程度の遮蔽（25dB→18dB）
-        else:
-            return 25  # 重度の遮蔽（35dB→25dB）
-            
-    except Exception as e:
-        # エラーログを出力
-        if np.random.random() < 0.001:
-            logging.warning(f"⚠️ Obstruction calc error: {e}")
-        return 0
+        except Exception as e:
+            logging.warning("⚠️ Ray casting failed: %s", e)
+            return intersection_counts
+
+        # 受音点より手前の交点のみを残し、音源直近の交点を除いてカウント
+        rays = active[index_ray]
+        hit_vectors = locations - source_pos
+        hit_distances = np.sqrt(np.einsum('ij,ij->i', hit_vectors, hit_vectors))
+        before_target = hit_distances < distances[rays] - 0.1
+        rays = rays[before_target]
+        intersection_counts[rays] += hit_distances[before_target] > 0.1
+
+        ray_origins[rays] = locations[before_target] + ray_offsets[rays]
+        active = rays[intersection_counts[rays] < max_count]
+        if len(active) == 0:
+            break
+
+    return intersection_counts
+
+def count_section_crossings(source_pos, target_positions, distances, section):
+    """音源から各受音点への線分と建物断面の交差数（計算点は音源と同じ高さなので2Dで判定）
+    
+    水平なレイが三角形と交わるのは、その三角形の断面の線分と交わるときに限られるため
+    3Dのレイキャスティングと同じ交差数になる
+    """
+    segments, tree = section
+    source_xz = source_pos[[0, 2]].astype(np.float64)
+    targets_xz = target_positions[:, [0, 2]]
+    rays = shapely.linestrings(np.stack([np.broadcast_to(source_xz, targets_xz.shape), targets_xz], axis=1))
+    index_ray, index_segment = tree.query(rays, predicate='intersects')
+    
+    # 交点までの距離（レイ上の位置 t を2Dの外積から求める）
+    ray_vectors = targets_xz[index_ray] - source_xz
+    segment_starts = segments[index_segment, 0] - source_xz
+    segment_vectors = segments[index_segment, 1] - segments[index_segment, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (
+            (segment_starts[:, 0] * segment_vectors[:, 1] - segment_starts[:, 1] * segment_vectors[:, 0]) /
+            (ray_vectors[:, 0] * segment_vectors[:, 1] - ray_vectors[:, 1] * segment_vectors[:, 0])
+        )
+    hit_distances = t * distances[index_ray]
+    
+    # 音源と受音点の間にある交点のみをレイごとにカウント
+    is_valid = (hit_distances > 0.1) & (hit_distances < distances[index_ray] - 0.1)
+    return np.bincount(index_ray[is_valid], minlength=len(target_positions))
 
 if __name__ == "__main__":
     import uvicorn
@@ -32,6 +32,17 @@ export interface ApiSoundResult {
   obstruction_count: number;
 }
 
+/**
+ * バイナリ形式のAPI結果（列指向のFloat32Array）
+ */
+export interface ApiSoundResultColumns {
+  x: Float32Array;
+  y: Float32Array;
+  z: Float32Array;
+  db: Float32Array;
+  distance: Float32Array;
+}
+
 /**
  * 音響伝播計算エンジン（API版）
  * バックエンドAPIを呼び出して現実的な音の伝播シミュレーションを行う
@@ -120,7 +131,8 @@ export class SoundCalculationEngineAPI {
         grid_size: gridSize,
         calc_range: calcRange,
         wind_direction: windDirection,
-        wind_speed: windSpeed
+        wind_speed: windSpeed,
+        response_format: 'binary' // JSONより小さく、デコードも高速
       };
 
       console.log('APIリクエスト:', requestData);
@@ -156,11 +168,11 @@ export class SoundCalculationEngineAPI {
         throw new Error(`API Error: ${response.status} ${response.statusText}`);
       }
 
-      const data = await response.json();
-      console.log('✅ API計算完了!', `処理済みポイント: ${data.points_processed}個`);
+      const columns = this.decodeBinaryResult(await response.arrayBuffer());
+      console.log('✅ API計算完了!', `処理済みポイント: ${columns.db.length}個`);
 
       // API結果をフロントエンド形式に変換（グリッドサイズ情報も含む）
-      return this.convertApiResultToCalculationResult(data.results, data.grid_size || gridSize);
+      return this.convertApiResultToCalculationResult(columns, gridSize);
 
     } catch (error) {
       console.error('API音響計算エラー:', error);
@@ -170,10 +182,33 @@ export class SoundCalculationEngineAPI {
     }
   }
 
+  /**
+   * バイナリ形式のAPI結果をデコード
+   * 先頭8バイトがint32の[点数, 列数]、その後に x, y, z, db, distance の順でfloat32の列が続く
+   */
+  private decodeBinaryResult(buffer: ArrayBuffer): ApiSoundResultColumns {
+    const header = new Int32Array(buffer, 0, 2);
+    const pointCount = header[0];
+    const columnCount = header[1];
+    if (columnCount !== 5) {
+      throw new Error(`Unexpected binary result: ${columnCount} columns (expected 5)`);
+    }
+    const values = new Float32Array(buffer, 8, pointCount * columnCount);
+    const column = (index: number) => values.subarray(index * pointCount, (index + 1) * pointCount);
+
+    return {
+      x: column(0),
+      y: column(1),
+      z: column(2),
+      db: column(3),
+      distance: column(4)
+    };
+  }
+
   /**
    * API結果をCalculationResult形式に変換
    */
-  private convertApiResultToCalculationResult(apiResults: ApiSoundResult[], actualGridSize: number): CalculationResult {
+  private convertApiResultToCalculationResult(apiResults: ApiSoundResultColumns, actualGridSize: number): CalculationResult {
     const gridPoints: Array<{
       position: THREE.Vector3;
       dB: number;
@@ -182,19 +217,22 @@ export class SoundCalculationEngineAPI {
 
     const heatmapData: HeatmapDataPoint[] = [];
 
-    for (const result of apiResults) {
+    for (let i = 0; i < apiResults.db.length; i++) {
+      const position = new THREE.Vector3(apiResults.x[i], apiResults.y[i], apiResults.z[i]);
+      const dB = apiResults.db[i];
+
       // グリッド点データ
       gridPoints.push({
-        position: new THREE.Vector3(result.x, result.y, result.z),
-        dB: result.db,
-        color: this.dBToColor(result.db)
+        position,
+        dB,
+        color: this.dBToColor(dB)
       });
 
       // ヒートマップデータ（地理座標に変換）
-      const geoCoords = this.worldToGeo(new THREE.Vector3(result.x, result.y, result.z));
+      const geoCoords = this.worldToGeo(position);
       heatmapData.push({
         coordinates: [geoCoords.longitude, geoCoords.latitude],
-        intensity: this.normalizeIntensity(result.db)
+        intensity: this.normalizeIntensity(dB)
       });
     }
 